@@ -0,0 +1,269 @@
+import contextlib
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+
+DAYS = ['mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun']
+UNITS = {'': 1, 'B': 1, 'KB': 1024, 'MB': 1024 ** 2, 'GB': 1024 ** 3}
+
+# Key that throttled time is charged to; threads started with a copied context inherit it
+_account = contextvars.ContextVar('bandwidth_account', default=None)
+
+
+def parse_rate(value, capacity=None):
+    """Bytes per second from 5000, '800KB', '2.5MB' or '20%' (of capacity); None means unlimited"""
+    if value is None or str(value).strip().lower() in ('', 'unlimited', 'none'):
+        return None
+    text = str(value).strip().upper()
+    if text.endswith('%'):
+        if capacity is None:
+            raise ValueError(f"Rate {value} is a percentage but no link_capacity is configured")
+        return capacity * float(text[:-1]) / 100
+    number = text.rstrip('KMGB')
+    unit = text[len(number):]
+    if unit not in UNITS:
+        raise ValueError(f"Unknown rate unit in {value}")
+    return float(number) * UNITS[unit]
+
+
+def parse_days(spec):
+    """Set of weekday indexes from '*', 'mon-fri' or 'sat,sun'"""
+    if not spec or spec == '*':
+        return set(range(7))
+    days = set()
+    for part in spec.lower().split(','):
+        if '-' in part:
+            first, last = (DAYS.index(day.strip()) for day in part.split('-'))
+            days.update(range(first, last + 1) if first <= last else [*range(first, 7), *range(0, last + 1)])
+        else:
+            days.add(DAYS.index(part.strip()))
+    return days
+
+
+class TokenBucket:
+    """Thread-safe byte-rate limiter shared by every stream in one direction
+
+    A rate of None is unlimited; 0 means paused, which the shaper enforces
+    between transfers, so the bucket itself lets it through. Consumers may take
+    more than the bucket holds; they then sleep off the debt, so large chunks
+    still average out to the configured rate.
+    """
+
+    def __init__(self, rate=None):
+        self._lock = threading.Lock()
+        self.rate = rate
+        self._tokens = 0
+        self._last = time.monotonic()
+
+    def set_rate(self, rate):
+        with self._lock:
+            if rate != self.rate:
+                self.rate = rate
+                self._tokens = 0
+                self._last = time.monotonic()
+
+    def consume(self, amount):
+        with self._lock:
+            if not self.rate:
+                return
+            now = time.monotonic()
+            # Allow at most one second of burst
+            self._tokens = min(self.rate, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= amount
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+
+class BandwidthShaper:
+    """Byte-rate limits for the download and upload paths, switched by time of day
+
+    Limits come from a JSON file that is re-read while transfers run, so
+    editing it changes the rates without a restart:
+
+        {
+            "link_capacity": {"download": "50MB", "upload": "10MB"},
+            "upload": {
+                "default": "unlimited",
+                "windows": [{"days": "mon-fri", "start": "09:00", "end": "18:00", "rate": "20%"}]
+            }
+        }
+
+    The first matching window wins; windows ending before they start wrap
+    past midnight. Without the file everything runs unthrottled.
+
+    Time spent paused or waiting on a bucket can be charged to a key with
+    accounting(), so callers can tell a throttled transfer from a stalled one.
+    """
+
+    DIRECTIONS = ('download', 'upload')
+
+    def __init__(self, config_path='bandwidth.json', check_interval=30):
+        self.config_path = config_path
+        self.check_interval = check_interval
+        self.buckets = {direction: TokenBucket() for direction in self.DIRECTIONS}
+        self._config = {}
+        self._config_mtime = None
+        self._next_check = 0
+        self._check_lock = threading.Lock()
+        self._throttled = {}  # account key -> [seconds throttled, threads waiting, waiting since]
+        self._throttled_lock = threading.Lock()
+
+    def throttle(self, direction, amount):
+        """Block until `amount` bytes may pass in `direction`"""
+        self._maybe_refresh()
+        bucket = self.buckets[direction]
+        # Pauses are applied by wait_if_paused() between items; a stream that is
+        # already running finishes rather than idling on an open connection
+        if not bucket.rate:
+            return
+        key = _account.get()
+        self._begin_wait(key)
+        try:
+            bucket.consume(amount)
+        finally:
+            self._end_wait(key)
+
+    def wait_if_paused(self, direction, stop_event=None):
+        """Block before a new transfer in `direction` while its rate is 0; False if `stop_event` ended the wait"""
+        self._maybe_refresh()
+        bucket = self.buckets[direction]
+        if bucket.rate != 0:
+            return True
+        logging.info(f"Bandwidth schedule pauses {direction}s, waiting")
+        stop_event = stop_event or threading.Event()
+        key = _account.get()
+        self._begin_wait(key)
+        try:
+            while bucket.rate == 0:
+                if stop_event.wait(1):
+                    return False
+                self._maybe_refresh()
+        finally:
+            self._end_wait(key)
+        return True
+
+    @contextlib.contextmanager
+    def accounting(self, key):
+        """Charge the time this thread, and threads it starts with a copied context, spend throttled to `key`"""
+        with self._throttled_lock:
+            self._throttled.setdefault(key, [0, 0, 0])
+        token = _account.set(key)
+        try:
+            yield
+        finally:
+            _account.reset(token)
+
+    def throttled_time(self, key):
+        """Wall-clock seconds during which at least one stream charged to `key` was held back"""
+        with self._throttled_lock:
+            state = self._throttled.get(key)
+            if state is None:
+                return 0
+            seconds, waiting, since = state
+            return seconds + (time.monotonic() - since if waiting else 0)
+
+    def forget(self, key):
+        with self._throttled_lock:
+            self._throttled.pop(key, None)
+
+    def _begin_wait(self, key):
+        with self._throttled_lock:
+            state = self._throttled.get(key)
+            if state is not None:
+                if not state[1]:
+                    state[2] = time.monotonic()
+                state[1] += 1
+
+    def _end_wait(self, key):
+        with self._throttled_lock:
+            state = self._throttled.get(key)
+            # Parallel streams of one key waiting together count once
+            if state is not None and state[1]:
+                state[1] -= 1
+                if not state[1]:
+                    state[0] += time.monotonic() - state[2]
+
+    def wrap_upload(self, data):
+        return ThrottledReader(data, self)
+
+    def _maybe_refresh(self):
+        now = time.monotonic()
+        if now < self._next_check or not self._check_lock.acquire(blocking=False):
+            return
+        try:
+            self._next_check = now + self.check_interval
+            self._reload_config()
+            for direction in self.DIRECTIONS:
+                self.buckets[direction].set_rate(self._scheduled_rate(direction, datetime.now()))
+        except Exception as e:
+            # Keep the previous limits rather than stopping the transfer
+            logging.error(f"Invalid bandwidth configuration in {self.config_path}: {str(e)}")
+        finally:
+            self._check_lock.release()
+
+    def _reload_config(self):
+        if not os.path.exists(self.config_path):
+            self._config, self._config_mtime = {}, None
+            return
+        mtime = os.path.getmtime(self.config_path)
+        if mtime != self._config_mtime:
+            with open(self.config_path) as f:
+                self._config = json.load(f)
+            self._config_mtime = mtime
+            logging.info(f"Bandwidth configuration loaded from {self.config_path}")
+
+    def _scheduled_rate(self, direction, now):
+        settings = self._config.get(direction, {})
+        capacity = parse_rate(self._config.get('link_capacity', {}).get(direction))
+        current = now.strftime('%H:%M')
+        for window in settings.get('windows', []):
+            start, end = window['start'], window['end']
+            in_time = start <= current < end if start <= end else (current >= start or current < end)
+            # After midnight, a wrapping window belongs to the previous day
+            day = now.weekday() if start <= end or current >= start else (now.weekday() - 1) % 7
+            if in_time and day in parse_days(window.get('days')):
+                return parse_rate(window['rate'], capacity)
+        return parse_rate(settings.get('default'), capacity)
+
+
+class ThrottledReader:
+    """File-like view of an upload body that paces reads through the shaper
+
+    Defines __len__, tell and seek so requests sends a Content-Length and
+    urllib3 can rewind the body when it retries a connection.
+    """
+
+    def __init__(self, data, shaper, direction='upload'):
+        self._data = memoryview(data)
+        self._shaper = shaper
+        self._direction = direction
+        self._position = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = len(self._data) - self._position
+        chunk = self._data[self._position:self._position + size]
+        self._position += len(chunk)
+        if chunk:
+            self._shaper.throttle(self._direction, len(chunk))
+        return chunk.tobytes()
+
+    def tell(self):
+        return self._position
+
+    def seek(self, position, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            position += self._position
+        elif whence == os.SEEK_END:
+            position += len(self._data)
+        self._position = position
+        return position
@@ -20,6 +20,12 @@ import httplib2  # Add this import instead of build_http
 from oauth2client.client import OAuth2Credentials
 import google_auth_httplib2
 import json
+from scheduling import BatchLanes, RetryQueue, pack_batches
+from transfer_state import DeadLetterQueue, TransferManifest, SyncState
+from token_manager import GoogleTokenManager
+from ranged_download import RangedDownloader, ChecksumMismatch
+from media_records import FlickrPhoto, GoogleMediaItem, ExistingMediaIndex
+from bandwidth import BandwidthShaper
 
 # Disable SSL warnings
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
@@ -33,6 +39,9 @@ print("FLICKR_API_SECRET:", os.getenv('FLICKR_API_SECRET'))
 class APIQuotaExceeded(Exception):
     pass
 
+class ShutdownRequested(Exception):
+    pass
+
 class PhotoTransferer:
     def __init__(self):
         # Logging configuration
@@ -106,6 +115,20 @@ class PhotoTransferer:
         # Increase semaphore limit for more concurrent uploads
         self.upload_semaphore = threading.Semaphore(2)  # Réduit de 5 à 2
         
+        # Byte-rate limits per direction, read from bandwidth.json and re-checked while running
+        self.bandwidth = BandwidthShaper('bandwidth.json')
+        
+        # Originals above the threshold are fetched as parallel byte ranges
+        self.RANGED_DOWNLOAD_THRESHOLD = 32 * 1024 * 1024
+        self.RANGED_DOWNLOAD_PARTS = 4
+        self.downloader = RangedDownloader(
+            session=self.session,
+            threshold=self.RANGED_DOWNLOAD_THRESHOLD,
+            parts=self.RANGED_DOWNLOAD_PARTS,
+            timeout=self.DOWNLOAD_TIMEOUT,
+            throttle=lambda amount: self.bandwidth.throttle('download', amount)
+        )
+        
         # Add event for graceful shutdown
         self.shutdown_event = threading.Event()
         
@@ -116,6 +139,40 @@ class PhotoTransferer:
         # Ajouter un délai entre les requêtes
         self.WRITE_REQUESTS_PER_MINUTE = 30  # Limite Google
         self.write_request_delay = 60 / self.WRITE_REQUESTS_PER_MINUTE  # ~2 secondes entre chaque requête
+        
+        # Retry scheduling: failed items are re-queued with jittered backoff
+        # instead of sleeping inside the worker thread
+        self.MAX_ATTEMPTS = 5
+        self.RETRY_BASE_DELAY = 2
+        self.RETRY_MAX_DELAY = 120
+        self.RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+        self.dead_letters = DeadLetterQueue('dead_letter.jsonl')
+        
+        # Record of uploaded media items, used by verify_transfers()
+        self.manifest = TransferManifest('transfer_manifest.jsonl')
+        self.VERIFY_BATCH_SIZE = 50  # mediaItems:batchGet limit
+        self.VERIFY_WORKERS = 8
+        
+        # High-water marks for sync()
+        self.sync_state = SyncState('sync_state.json')
+        
+        # Size-aware scheduling: large media get their own lane, and time
+        # budgets scale with bytes instead of a fixed timeout
+        self.LARGE_MEDIA_THRESHOLD = 50 * 1024 * 1024
+        self.LARGE_MEDIA_WORKERS = 1
+        self.large_upload_semaphore = threading.Semaphore(self.LARGE_MEDIA_WORKERS)
+        self.SMALL_BATCH_BYTES = 40 * 1024 * 1024
+        self.VIDEO_SIZE_ESTIMATE = 500 * 1024 * 1024  # Flickr extras carry no video byte size; replaced once the download starts
+        self.DEFAULT_SIZE_ESTIMATE = 5 * 1024 * 1024
+        self.BYTES_PER_PIXEL_ESTIMATE = 0.5  # Typical high-quality JPEG
+        self.BASE_TIMEOUT = 60
+        self.MIN_TRANSFER_RATE = 256 * 1024  # Bytes/s below which a transfer counts as stalled
+        self.DEADLINE_CHECK_INTERVAL = 5
+        
+        # Streaming: listings are consumed lazily, only a few batches ahead of the workers
+        self.PACKING_WINDOW = 256
+        self.BATCHES_AHEAD_PER_WORKER = 2
+        self.MAX_HELD_BATCHES = 64
 
     def _check_flickr_quota(self):
         # Reset counter every hour
@@ -147,10 +204,9 @@ class PhotoTransferer:
                 creds = Credentials.from_authorized_user_file('token.json', self.SCOPES)
 
             # If there are no (valid) credentials available, let the user log in.
+            # Expired credentials with a refresh token are refreshed by the token manager.
             if not creds or not creds.valid:
-                if creds and creds.expired and creds.refresh_token:
-                    creds.refresh(Request())
-                else:
+                if not (creds and creds.expired and creds.refresh_token):
                     flow = InstalledAppFlow.from_client_secrets_file(
                         'client_secrets.json',
                         scopes=self.SCOPES
@@ -164,9 +220,13 @@ class PhotoTransferer:
 
             self.credentials = creds
             
+            # One token manager shared by the discovery client and the raw upload requests
+            self.token_manager = GoogleTokenManager(creds, token_file='token.json')
+            self.token_manager.get_token()
+            self.token_manager.start()
+            
             # Create authorized HTTP object
-            authorized_http = google_auth_httplib2.AuthorizedHttp(
-                creds, http=httplib2.Http())
+            authorized_http = self.token_manager.authorized_http()
 
             service = build('photoslibrary', 'v1', 
                           http=authorized_http,
@@ -239,14 +299,14 @@ class PhotoTransferer:
         return name
 
     def get_album_photos(self, album_id):
-        """Retrieves all photos from a Google Photos album with proper pagination"""
+        """Yields every item of a Google Photos album as compact records, page by page"""
         try:
-            photos = []
             page_token = None
             page_size = 100
+            count = 0
             
             while True:
-                logging.info(f"Fetching page of photos for album {album_id} (current count: {len(photos)})")
+                logging.info(f"Fetching page of photos for album {album_id} (current count: {count})")
                 
                 response = self.google_photos.mediaItems().search(
                     body={
@@ -257,63 +317,164 @@ class PhotoTransferer:
                 ).execute()
                 
                 if 'mediaItems' in response:
+                    logging.info(f"Retrieved {len(response['mediaItems'])} items in this page")
                     for item in response['mediaItems']:
                         # Stocker plus d'informations pour une meilleure comparaison
-                        photos.append({
-                            'id': item['id'],
-                            'clean_name': self._normalize_filename(item['filename']),
-                            'original_name': item['filename'],
-                            'google_id': item['id'],
-                            'creation_time': item.get('mediaMetadata', {}).get('creationTime'),
-                            'width': item.get('mediaMetadata', {}).get('width'),
-                            'height': item.get('mediaMetadata', {}).get('height'),
-                            'mime_type': item.get('mimeType')
-                        })
-                    
-                    logging.info(f"Retrieved {len(response['mediaItems'])} items in this page")
-                    # Log détaillé des fichiers existants
-                    for item in photos[-len(response['mediaItems']):]:
-                        logging.info(f"Found existing file: {item['original_name']} (ID: {item['google_id']})")
+                        metadata = item.get('mediaMetadata', {})
+                        count += 1
+                        # Log détaillé des fichiers existants
+                        logging.info(f"Found existing file: {item['filename']} (ID: {item['id']})")
+                        yield GoogleMediaItem(
+                            id=item['id'],
+                            clean_name=self._normalize_filename(item['filename']),
+                            original_name=item['filename'],
+                            creation_time=metadata.get('creationTime'),
+                            width=metadata.get('width'),
+                            height=metadata.get('height'),
+                            mime_type=item.get('mimeType')
+                        )
                 
                 page_token = response.get('nextPageToken')
                 if not page_token:
                     break
             
-            return photos
-            
         except Exception as e:
             logging.error(f"Error during photo retrieval: {str(e)}")
             raise
 
-    def _get_all_flickr_photos(self, photoset_id):
-        """Récupère toutes les photos d'un album Flickr avec pagination"""
-        all_photos = []
+    def _iter_flickr_photos(self, photoset_id):
+        """Yields the photos of a Flickr album page by page as compact records"""
         page = 1
         per_page = 500
         
         while True:
             photos = self.flickr.photosets.getPhotos(
                 photoset_id=photoset_id,
-                extras='url_o,original_format',
+                extras='url_o,original_format,o_dims,media',
                 page=page,
                 per_page=per_page
             )
             
             if 'photoset' not in photos or 'photo' not in photos['photoset']:
                 break
-                
-            all_photos.extend(photos['photoset']['photo'])
             
-            if len(photos['photoset']['photo']) < per_page:
+            page_items = photos['photoset']['photo']
+            for item in page_items:
+                yield FlickrPhoto.from_dict(item)
+            
+            if len(page_items) < per_page:
                 break
                 
             page += 1
+
+    def _iter_recently_updated(self, min_date):
+        """Yields photostream items updated since `min_date` (unix time) as compact records"""
+        page = 1
+        per_page = 500
+        
+        while True:
+            self._check_flickr_quota()
+            photos = self.flickr.photos.recentlyUpdated(
+                min_date=min_date,
+                extras='url_o,original_format,o_dims,media',
+                page=page,
+                per_page=per_page
+            )
+            
+            page_items = photos.get('photos', {}).get('photo', [])
+            for item in page_items:
+                yield FlickrPhoto.from_dict(item)
+            
+            if page >= int(photos.get('photos', {}).get('pages', 1)):
+                break
+            page += 1
+
+    def _sync_album_delta(self, flickr_album, google_album_id, known_ids):
+        """Transfer the photos of a changed album that the manifest doesn't know yet"""
+        album_name = flickr_album['title']['_content']
+        total_photos = int(flickr_album.get('photos', 0)) + int(flickr_album.get('videos', 0))
+        new_photos = (photo for photo in self._iter_flickr_photos(flickr_album['id'])
+                      if photo.id not in known_ids)
+        
+        print(f"\nSyncing changed album: {album_name}")
+        # The manifest replaces the Google listing as the duplicate check
+        counts = self._run_photo_queue(new_photos, google_album_id, ExistingMediaIndex(), album_name)
+        
+        return {
+            'album_name': album_name,
+            'total': total_photos,
+            'transferred': counts['transferred'],
+            'skipped': counts['skipped'],
+            'failed': counts['failed'],
+            'google_album_id': google_album_id,
+            'status': 'interrupted' if counts['interrupted'] else 'synced'
+        }
+
+    def sync(self):
+        """Transfer only what was added or changed on Flickr since the last sync, using the manifest instead of Google listings"""
+        run_started = int(time.time())
+        results = []
+        known_ids = self.manifest.flickr_ids_by_album()
+        
+        albums = self.get_flickr_albums()
+        unchanged = 0
+        for album in albums:
+            album_name = album['title']['_content']
+            state = self.sync_state.album(album['id'])
+            date_update = int(album.get('date_update', 0))
+            
+            if state and date_update and state['date_update'] >= date_update:
+                unchanged += 1
+                logging.info(f"Album unchanged since last sync: {album_name}")
+                continue
             
-        return all_photos
+            if state:
+                result = self._sync_album_delta(album, state['google_album_id'],
+                                                known_ids.get(state['google_album_id'], set()))
+            else:
+                print(f"\nFirst sync of album: {album_name}")
+                result = self._transfer_single_album(album)
+            results.append(result)
+            
+            if result.get('status') == 'interrupted':
+                return results
+            # Failed items are in the dead-letter queue, so the mark can move on
+            self.sync_state.set_album(album['id'], album_name, date_update, result['google_album_id'])
+        
+        print(f"\n{unchanged} of {len(albums)} albums unchanged since last sync")
+        
+        mark = self.sync_state.photostream_mark()
+        if mark is None:
+            # The tool has always mirrored albums only; start tracking the photostream from now on
+            print("Photostream baseline recorded, new uploads will be synced from the next run")
+        else:
+            # Re-read the manifest so photos just transferred with their albums are excluded,
+            # and leave dead-lettered photos to the replay instead of uploading them twice
+            handled_ids = set()
+            for ids in self.manifest.flickr_ids_by_album().values():
+                handled_ids.update(ids)
+            handled_ids.update(entry['photo']['id'] for entry in self.dead_letters.entries())
+            new_photos = (photo for photo in self._iter_recently_updated(mark)
+                          if photo.id not in handled_ids)
+            print("\nSyncing photostream updates...")
+            counts = self._run_photo_queue(new_photos, None, ExistingMediaIndex(), 'Photostream')
+            results.append({
+                'album_name': 'Photostream',
+                'total': counts['processed'],
+                'transferred': counts['transferred'],
+                'skipped': counts['skipped'],
+                'failed': counts['failed'],
+                'status': 'interrupted' if counts['interrupted'] else 'synced'
+            })
+            if counts['interrupted']:
+                return results
+        
+        # Small overlap so updates landing while this run started aren't missed
+        self.sync_state.set_photostream_mark(run_started - 60)
+        return results
 
     def _transfer_single_album(self, flickr_album, google_albums=None):
         """Handle transfer of albums under the Google Photos limit"""
-        executor = None
         try:
             album_name = flickr_album['title']['_content']
             
@@ -327,152 +488,335 @@ class PhotoTransferer:
                 None
             )
             
+            # Flickr counts photos and videos separately
+            total_photos = int(flickr_album.get('photos', 0)) + int(flickr_album.get('videos', 0))
+            
             if existing_album:
                 google_album = existing_album
-                existing_photos = self.get_album_photos(existing_album['id'])
+                existing_photos = ExistingMediaIndex(self.get_album_photos(existing_album['id']))
                 google_photo_count = len(existing_photos)
                 logging.info(f"Google Photos album '{album_name}' contains {google_photo_count} items")
                 print(f"Google Photos album contains {google_photo_count} items")
-                print(f"Difference: {int(flickr_album['photos']) - google_photo_count} items to transfer")
+                print(f"Difference: {total_photos - google_photo_count} items to transfer")
             else:
                 album_body = {
                     'album': {'title': album_name}
                 }
                 google_album = self.google_photos.albums().create(body=album_body).execute()
                 logging.info(f"Created new album: {album_name}")
-                existing_photos = []
+                existing_photos = ExistingMediaIndex()
                 google_photo_count = 0
             
-            # Get Flickr photos with pagination
-            photos = self._get_all_flickr_photos(flickr_album['id'])
-            total_photos = len(photos)
-            print(f"\nTotal number of photos in the Flickr album: {total_photos}")
-            
-            transferred_photos = 0
-            skipped_photos = 0
-            failed_photos = 0
-            processed_photos = 0  # Nouveau compteur pour le total traité
-            
-            # Create set of existing photo names for quick lookup
-            existing_photo_names = {photo['clean_name'] for photo in existing_photos}
+            # Flickr pages are fetched lazily while the first transfers run
+            photos = self._iter_flickr_photos(flickr_album['id'])
+            print(f"\nTotal number of media items in the Flickr album: {total_photos}")
             
             print("\nStarting photo analysis...")
             logging.info(f"Starting photo analysis for album: {album_name}")
             
-            # Process in batches
-            batch_size = self.BATCH_SIZE
-            photo_batches = [
-                photos[i:i + batch_size]
-                for i in range(0, total_photos, batch_size)
-            ]
+            counts = self._run_photo_queue(photos, google_album['id'], existing_photos, album_name, total_photos)
             
-            # Process batches in parallel with proper cleanup
-            executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.MAX_WORKERS)
-            futures = []
-            
-            try:
-                # Submit all batches to the executor
-                for batch in photo_batches:
-                    if self.shutdown_event.is_set():
-                        logging.info("Graceful shutdown requested")
-                        break
-                    future = executor.submit(self._process_photo_batch, batch, google_album['id'], existing_photos)
-                    futures.append(future)
-                
-                # Process results with longer timeout and better error handling
-                completed_futures = []
-                for future in concurrent.futures.as_completed(futures):
-                    try:
-                        batch_results = future.result(timeout=300)
-                        completed_futures.append(future)
-                        
-                        for result in batch_results:
-                            processed_photos += 1  # Incrémenter pour chaque photo traitée
-                            if result['status'] == 'transferred':
-                                transferred_photos += 1
-                            elif result['status'] == 'skipped':
-                                skipped_photos += 1
-                            else:
-                                failed_photos += 1
-                            
-                            # Afficher la progression incluant les skipped
-                            print(f"Progress: {processed_photos}/{total_photos} processed ({transferred_photos} transferred, {skipped_photos} skipped, {failed_photos} failed)")
-                            
-                    except concurrent.futures.TimeoutError:
-                        logging.error(f"Batch processing timeout after 5 minutes")
-                        batch_index = futures.index(future)
-                        failed_photos += len(photo_batches[batch_index])
-                        print(f"Batch {batch_index + 1} timed out - moving to next batch")
-                    except Exception as e:
-                        logging.error(f"Batch processing error: {str(e)}")
-                        batch_index = futures.index(future)
-                        failed_photos += len(photo_batches[batch_index])
-                
-                # Check for unfinished futures
-                unfinished_futures = set(futures) - set(completed_futures)
-                if unfinished_futures:
-                    unfinished_count = len(unfinished_futures)
-                    total_futures = len(futures)
-                    logging.warning(f"{unfinished_count} (of {total_futures}) futures unfinished")
-                    print(f"\nWarning: {unfinished_count} batches did not complete successfully")
-                    
-                    # Cancel unfinished futures
-                    for future in unfinished_futures:
-                        future.cancel()
-                        batch_index = futures.index(future)
-                        failed_photos += len(photo_batches[batch_index])
-                
-            except KeyboardInterrupt:
-                logging.info("Received interrupt signal, initiating graceful shutdown")
-                self.shutdown_event.set()
-                # Cancel pending futures
-                for future in futures:
-                    future.cancel()
-                print("\nGracefully shutting down... (this may take a moment)")
+            if counts['interrupted']:
                 return {
                     'album_name': album_name,
                     'total': total_photos,
-                    'transferred': transferred_photos,
-                    'skipped': skipped_photos,
-                    'failed': failed_photos,
+                    'transferred': counts['transferred'],
+                    'skipped': counts['skipped'],
+                    'failed': counts['failed'],
+                    'google_album_id': google_album['id'],
                     'status': 'interrupted'
                 }
-                
-            finally:
-                if executor:
-                    print("Shutting down executor...")
-                    executor.shutdown(wait=True, cancel_futures=True)
-                    print("Executor shutdown complete")
             
             summary_message = (
                 f"\nTransfer summary for album '{album_name}':\n"
-                f"- Total media items found: {total_photos}\n"
-                f"- Already existing: {skipped_photos}\n"
-                f"- Successfully transferred: {transferred_photos}\n"
-                f"- Failed transfers: {failed_photos}"
+                f"- Total media items found: {counts['processed']}\n"
+                f"- Already existing: {counts['skipped']}\n"
+                f"- Successfully transferred: {counts['transferred']}\n"
+                f"- Failed transfers: {counts['failed']} (see {self.dead_letters.path})\n"
+                f"- Retries scheduled: {counts['retried']}"
             )
             print(summary_message)
             logging.info(summary_message)
             
             return {
                 'album_name': album_name,
-                'total': total_photos,
-                'transferred': transferred_photos,
-                'skipped': skipped_photos,
-                'failed': failed_photos
+                'total': counts['processed'],
+                'transferred': counts['transferred'],
+                'skipped': counts['skipped'],
+                'failed': counts['failed'],
+                'google_album_id': google_album['id']
             }
             
         except Exception as e:
             logging.error(f"Error transferring album {album_name}: {str(e)}")
             raise
+
+    def _estimate_media_size(self, photo):
+        """Best guess of an item's original size in bytes, made without requests; workers replace it with the real size"""
+        if photo.size_estimate is not None:
+            return photo.size_estimate
+        
+        if photo.media == 'video':
+            size = self.VIDEO_SIZE_ESTIMATE
+        elif photo.width and photo.height:
+            size = int(photo.width * photo.height * self.BYTES_PER_PIXEL_ESTIMATE)
+        else:
+            size = self.DEFAULT_SIZE_ESTIMATE
+        
+        photo.size_estimate = size
+        return size
+
+    def _is_large_media(self, photo):
+        return photo.media == 'video' or self._estimate_media_size(photo) >= self.LARGE_MEDIA_THRESHOLD
+
+    def _lane_batches(self, photos):
+        """Turn a photo stream into (batch, is_large) pairs without reading it all first"""
+        for batch in pack_batches(photos, self._estimate_media_size, self.SMALL_BATCH_BYTES,
+                                  self.BATCH_SIZE, window=self.PACKING_WINDOW):
+            yield batch, any(self._is_large_media(photo) for photo in batch)
+
+    def _batch_budget(self, batch):
+        """Time budget of a batch, re-read on every check since workers replace size estimates"""
+        return sum(self._timeout_for(self._estimate_media_size(photo)) for photo in batch)
+
+    def _timeout_for(self, size):
+        """Time budget for downloading and uploading `size` bytes at the slowest acceptable rate"""
+        return self.BASE_TIMEOUT + self.write_request_delay + 2 * size / self.MIN_TRANSFER_RATE
+
+    def _run_photo_queue(self, photos, album_id, existing_photos, album_name, total_photos=None, on_settled=None):
+        """Run a lazy photo stream through the size lanes; `on_settled` gets each transferred or skipped photo"""
+        counts = {'processed': 0, 'transferred': 0, 'skipped': 0, 'failed': 0, 'retried': 0, 'interrupted': False}
+        attempts = {}  # photo id -> attempts so far, dropped once the photo is settled
+        retry_queue = RetryQueue(self.RETRY_BASE_DELAY, self.RETRY_MAX_DELAY)
+        semaphores = {False: self.upload_semaphore, True: self.large_upload_semaphore}
+        
+        def run_batch(batch, large, key):
+            with self.bandwidth.accounting(key):
+                return self._process_photo_batch(batch, album_id, existing_photos, semaphores[large])
+        
+        def count_attempt(batch):
+            for photo in batch:
+                attempts[photo.id] = attempts.get(photo.id, 0) + 1
+        
+        lanes = BatchLanes(
+            run_batch, {False: self.MAX_WORKERS, True: self.LARGE_MEDIA_WORKERS},
+            self.BATCHES_AHEAD_PER_WORKER, self.MAX_HELD_BATCHES,
+            on_submit=count_attempt, on_release=self.bandwidth.forget
+        )
+        batches = self._lane_batches(photos)
+        
+        def finish(photo, status):
+            counts[status] += 1
+            counts['processed'] += 1
+            attempts.pop(photo.id, None)
+            if on_settled and status != 'failed':
+                on_settled(photo)
+            print(f"Progress: {counts['processed']}/{total_photos or '?'} processed ({counts['transferred']} transferred, {counts['skipped']} skipped, {counts['failed']} failed)")
+        
+        def dead_letter(photo, error_class, error):
+            self.dead_letters.add(photo.to_dict(), album_id, album_name, error_class, error, attempts.get(photo.id, 0))
+            finish(photo, 'failed')
+        
+        def record(result, can_retry=True):
+            photo = result['photo']
+            if result['status'] in ('transferred', 'skipped'):
+                finish(photo, result['status'])
+            elif can_retry and result['status'] == 'retry' and attempts[photo.id] < self.MAX_ATTEMPTS:
+                delay = retry_queue.backoff(attempts[photo.id], result.get('retry_after'))
+                retry_queue.schedule(photo, delay)
+                counts['retried'] += 1
+                logging.info(f"Photo {photo.id} re-queued for attempt {attempts[photo.id] + 1} in {delay:.1f}s")
+            else:
+                dead_letter(photo, result['error_class'], result['error'])
+        
+        def reconcile(future):
+            """Take back the dead-letter of timed-out photos whose worker got them through after all"""
+            _, given_up = lanes.collect_abandoned(future)
+            try:
+                batch_results = future.result()
+            except Exception:
+                return
+            for result in batch_results:
+                photo = result['photo']
+                if result['status'] in ('transferred', 'skipped') and photo.id in given_up:
+                    logging.info(f"Photo {photo.id} finished after its batch timed out")
+                    self.dead_letters.discard(photo.id, album_id)
+                    counts['failed'] -= 1
+                    counts['processed'] -= 1
+                    finish(photo, result['status'])
+        
+        def stop():
+            """Dead-letter all queued work; batches already running are collected once the workers stop"""
+            counts['interrupted'] = True
+            logging.warning(f"{len(lanes.pending)} batches unfinished, {len(retry_queue)} retries still queued")
+            for batch in lanes.cancel_queued():
+                for photo in batch:
+                    dead_letter(photo, 'ShutdownRequested', 'Transfer stopped before this item ran')
+            for photo in retry_queue.pop_all():
+                dead_letter(photo, 'ShutdownRequested', 'Transfer stopped before retry')
+            # The unread rest of the stream is picked up again by the next transfer or sync of the album
+        
+        try:
+            while True:
+                if self.shutdown_event.is_set():
+                    logging.info("Graceful shutdown requested")
+                    break
+                
+                for photo in retry_queue.pop_due():
+                    lanes.submit([photo], self._is_large_media(photo))
+                lanes.fill(batches)
+                
+                if not lanes.busy():
+                    if not len(retry_queue) and lanes.finished():
+                        break
+                    # Only delayed retries left: wait here, not in a worker
+                    time.sleep(retry_queue.next_due_in() or 0)
+                    continue
+                
+                # Wake up regularly to enforce the per-batch time budgets
+                next_due = retry_queue.next_due_in()
+                for future in lanes.wait(self.DEADLINE_CHECK_INTERVAL if next_due is None
+                                         else min(next_due, self.DEADLINE_CHECK_INTERVAL)):
+                    if future in lanes.abandoned:
+                        reconcile(future)
+                        continue
+                    batch = lanes.settle(future)
+                    try:
+                        batch_results = future.result()
+                    except Exception as e:
+                        logging.error(f"Batch processing error: {str(e)}")
+                        batch_results = [self._failure_result(photo, e) for photo in batch]
+                    for result in batch_results:
+                        record(result)
+                
+                for future, batch, budget in lanes.overdue(self._batch_budget, self.bandwidth.throttled_time):
+                    # The worker thread can't be interrupted; its late result is reconciled
+                    logging.error(f"Batch of {len(batch)} items exceeded its {budget:.0f}s budget")
+                    print(f"Batch timed out after {budget:.0f}s - moving on")
+                    # Photos the worker already uploaded are in the manifest
+                    recorded = self.manifest.flickr_ids_by_album().get(album_id, set())
+                    given_up = set()
+                    for photo in batch:
+                        if photo.id in recorded:
+                            finish(photo, 'transferred')
+                        else:
+                            dead_letter(photo, 'TimeoutError', f"Exceeded {budget:.0f}s time budget")
+                            given_up.add(photo.id)
+                    lanes.abandon(future, given_up)
+            
+            # Anything left over was stopped by a shutdown request; callers
+            # must not treat a partly read stream as synced
+            if lanes.pending or len(retry_queue) or not lanes.finished():
+                print(f"\nWarning: {len(lanes.pending)} batches did not complete successfully")
+                stop()
+        
+        except KeyboardInterrupt:
+            logging.info("Received interrupt signal, initiating graceful shutdown")
+            self.shutdown_event.set()
+            print("\nGracefully shutting down... (this may take a moment)")
+            stop()
+        
         finally:
-            if executor:
-                try:
-                    executor.shutdown(wait=False)
-                except Exception as e:
-                    logging.error(f"Error shutting down executor: {str(e)}")
+            print("Shutting down executor...")
+            lanes.shutdown()
+            print("Executor shutdown complete")
+        
+        # Batches that were already running have finished now; there is no retry left for them
+        for future in list(lanes.pending):
+            batch = lanes.settle(future)
+            try:
+                batch_results = future.result()
+            except Exception as e:
+                batch_results = [self._failure_result(photo, e) for photo in batch]
+            for result in batch_results:
+                record(result, can_retry=False)
+        for future in list(lanes.abandoned):
+            reconcile(future)
+        
+        return counts
+
+    def _classify_error(self, error):
+        """Returns (retryable, retry_after) for a failed transfer attempt"""
+        if isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout, ChecksumMismatch)):
+            return True, None
+        
+        if isinstance(error, HttpError):
+            # httplib2 responses are header dicts with a status attribute
+            status = error.resp.status
+            retry_after = error.resp.get('retry-after', '')
+        elif getattr(error, 'response', None) is not None:
+            status = error.response.status_code
+            retry_after = error.response.headers.get('Retry-After', '')
+        else:
+            return False, None
+        
+        if status == 401:
+            # Token rejected: force a (deduplicated) refresh and try again
+            self.token_manager.refresh()
+            return True, None
+        if status not in self.RETRYABLE_STATUS_CODES:
+            return False, None
+        return True, int(retry_after) if retry_after.isdigit() else None
+
+    def _failure_result(self, photo, error):
+        """Build a failed result, flagged for retry when the error is transient"""
+        retryable, retry_after = self._classify_error(error)
+        return {
+            'photo_id': photo.id,
+            'photo': photo,
+            'status': 'retry' if retryable else 'failed',
+            'error': str(error),
+            'error_class': type(error).__name__,
+            'retry_after': retry_after
+        }
 
-    def _process_photo_batch(self, photos, album_id, existing_photos):
+    def replay_dead_letters(self):
+        """Re-run every photo from the dead-letter queue, grouped by target album"""
+        # Start from a file without the tombstones of earlier runs
+        entries = self.dead_letters.compact()
+        if not entries:
+            print("Dead-letter queue is empty")
+            return []
+        
+        by_album = {}
+        for entry in entries:
+            by_album.setdefault(entry['google_album_id'], []).append(entry)
+        
+        known_ids = self.manifest.flickr_ids_by_album()
+        results = []
+        for album_id, album_entries in by_album.items():
+            album_name = album_entries[0]['album_name']
+            print(f"\nReplaying {len(album_entries)} dead-lettered items for album: {album_name}")
+            # Library-only uploads have no album listing to catch duplicates, so
+            # drop entries for photos the manifest shows did make it
+            recorded = known_ids.get(album_id, set())
+            already_done = [entry for entry in album_entries if entry['photo']['id'] in recorded]
+            if already_done:
+                print(f"{len(already_done)} items were transferred after they failed, removing them")
+                self.dead_letters.remove(already_done)
+            
+            existing_photos = ExistingMediaIndex(self.get_album_photos(album_id) if album_id else ())
+            photos = [FlickrPhoto.from_dict(entry['photo']) for entry in album_entries
+                      if entry['photo']['id'] not in recorded]
+            # An entry only goes once its photo made it; a new failure replaces it, and
+            # anything not reached before a shutdown keeps it
+            counts = self._run_photo_queue(
+                photos, album_id, existing_photos, album_name, len(photos),
+                on_settled=lambda photo: self.dead_letters.discard(photo.id, album_id)
+            )
+            results.append({
+                'album_name': album_name,
+                'total': len(album_entries),
+                'transferred': counts['transferred'],
+                'skipped': counts['skipped'] + len(already_done),
+                'failed': counts['failed']
+            })
+            if counts['interrupted']:
+                break
+        
+        return results
+
+    def _process_photo_batch(self, photos, album_id, existing_photos, semaphore=None):
         """Process a batch of photos with improved memory management"""
         results = []
         thread_id = threading.get_ident()
@@ -480,19 +824,18 @@ class PhotoTransferer:
         logging.info(f"Starting batch processing in thread {thread_id}")
         
         for photo in photos:
-            session = None
             content = None
             photo_info = None
             
             try:
-                with self.upload_semaphore:
+                with semaphore or self.upload_semaphore:
                     # Récupérer les infos de la photo dans un bloc try séparé
                     try:
-                        photo_info = self.flickr.photos.getInfo(photo_id=photo['id'])
+                        photo_info = self.flickr.photos.getInfo(photo_id=photo.id)
                         photo_title = photo_info['photo']['title']['_content']
                         logging.info(f"Processing file:")
                         logging.info(f"  - Original Flickr title: {photo_title}")
-                        logging.info(f"  - Flickr photo ID: {photo['id']}")
+                        logging.info(f"  - Flickr photo ID: {photo.id}")
                         
                         # Amélioration de la vérification des doublons
                         clean_name = self._normalize_filename(photo_title)
@@ -501,28 +844,23 @@ class PhotoTransferer:
                         logging.info(f"Checking if photo exists: {photo_title}")
                         logging.info(f"Normalized name: {clean_name}")
                         
-                        # Vérification plus stricte
-                        photo_exists = False
-                        for existing_photo in existing_photos:
-                            if (existing_photo['clean_name'] == clean_name or
-                                existing_photo['original_name'] == photo_title):
-                                photo_exists = True
-                                logging.info(f"Found match:")
-                                logging.info(f"  - Existing: {existing_photo['original_name']}")
-                                logging.info(f"  - New: {photo_title}")
-                                break
-                        
-                        if photo_exists:
+                        # Vérification plus stricte (nom normalisé ou nom original)
+                        existing_id = existing_photos.match(clean_name, photo_title)
+                        if existing_id:
                             logging.info(f"Skipping duplicate: {photo_title}")
+                            # Remember the match so incremental syncs don't need the Google listing
+                            self.manifest.record(photo.id, existing_id, album_id, photo_title, None,
+                                                 width=photo.width, height=photo.height)
                             results.append({
-                                'photo_id': photo['id'],
+                                'photo_id': photo.id,
+                                'photo': photo,
                                 'status': 'skipped',
                                 'error': None
                             })
                             continue
                             
                         # Récupérer les tailles disponibles
-                        sizes = self.flickr.photos.getSizes(photo_id=photo['id'])
+                        sizes = self.flickr.photos.getSizes(photo_id=photo.id)
                         if 'sizes' in sizes and 'size' in sizes['sizes']:
                             available_sizes = sizes['sizes']['size']
                             logging.info(f"  - Available sizes: {[size['label'] for size in available_sizes]}")
@@ -534,61 +872,228 @@ class PhotoTransferer:
                             logging.info(f"  - Selected photo size: {best_quality['label']}")
                             logging.info(f"  - Media URL: {media_url}")
                             
-                            # Créer une nouvelle session pour chaque téléchargement
-                            session = requests.Session()
-                            adapter = requests.adapters.HTTPAdapter(max_retries=3)
-                            session.mount('http://', adapter)
-                            session.mount('https://', adapter)
+                            # Télécharger via le pool partagé; les gros originaux sont
+                            # récupérés en plages d'octets parallèles
+                            if not self.bandwidth.wait_if_paused('download', self.shutdown_event):
+                                raise ShutdownRequested("Transfer stopped while downloads were paused")
+                            # The real size replaces the estimate, so the batch budget follows it
+                            content = self.downloader.fetch(
+                                media_url, on_size=lambda size, photo=photo: setattr(photo, 'size_estimate', size)
+                            )
                             
-                            # Télécharger avec gestion de la mémoire
-                            with session.get(media_url, stream=True, timeout=300) as response:
-                                response.raise_for_status()
-                                content = response.content
-                                
-                                # Upload immédiat après téléchargement
-                                if content:
-                                    upload_result = self._upload_to_google_photos(content, album_id, photo_info=photo_info)
-                                    if upload_result:
-                                        print(f"Media: '{photo_title}' - transferred successfully ↑")
-                                        logging.info(f"  - Successfully uploaded to Google Photos")
-                                        results.append({
-                                            'photo_id': photo['id'],
-                                            'status': 'transferred',
-                                            'error': None
-                                        })
-                                    else:
-                                        raise Exception("Upload failed")
+                            # Upload immédiat après téléchargement
+                            if content:
+                                if not self.bandwidth.wait_if_paused('upload', self.shutdown_event):
+                                    raise ShutdownRequested("Transfer stopped while uploads were paused")
+                                upload_result = self._upload_to_google_photos(content, album_id, photo_info=photo_info)
+                                if upload_result:
+                                    if upload_result.get('id'):
+                                        self.manifest.record(
+                                            photo.id, upload_result['id'], album_id,
+                                            upload_result.get('filename', photo_title),
+                                            photo.expected_mime_type(),
+                                            width=photo.width,
+                                            height=photo.height
+                                        )
+                                    print(f"Media: '{photo_title}' - transferred successfully ↑")
+                                    logging.info(f"  - Successfully uploaded to Google Photos")
+                                    results.append({
+                                        'photo_id': photo.id,
+                                        'photo': photo,
+                                        'status': 'transferred',
+                                        'error': None
+                                    })
                                 else:
-                                    raise Exception("Downloaded content is empty")
+                                    raise Exception("Upload failed")
+                            else:
+                                raise Exception("Downloaded content is empty")
+                        else:
+                            raise Exception("No sizes available from Flickr")
                                 
                     except Exception as e:
-                        error_msg = f"Media: '{photo_title if 'photo_title' in locals() else 'Unknown'}' - transfer failed ✗ ({str(e)})"
+                        result = self._failure_result(photo, e)
+                        outcome = 'will retry' if result['status'] == 'retry' else 'transfer failed ✗'
+                        error_msg = f"Media: '{photo_title if 'photo_title' in locals() else 'Unknown'}' - {outcome} ({str(e)})"
                         print(error_msg)
                         logging.error(error_msg)
-                        results.append({
-                            'photo_id': photo['id'],
-                            'status': 'failed',
-                            'error': str(e)
-                        })
+                        results.append(result)
                         
             finally:
                 # Nettoyage explicite des ressources
-                if session:
-                    session.close()
                 if content:
                     del content
                 if photo_info:
                     del photo_info
-                session = None
                 content = None
                 photo_info = None
         
         return results
 
+    def _google_auth_headers(self):
+        """Bearer header for raw requests against the Photos Library API"""
+        return {'Authorization': f'Bearer {self.token_manager.get_token()}'}
+
+    def _batch_get_media_items(self, media_ids):
+        """Fetch up to 50 media items in one mediaItems:batchGet call"""
+        response = self.session.get(
+            'https://photoslibrary.googleapis.com/v1/mediaItems:batchGet',
+            params=[('mediaItemIds', media_id) for media_id in media_ids],
+            headers=self._google_auth_headers(),
+            timeout=60
+        )
+        response.raise_for_status()
+        return response.json().get('mediaItemResults', [])
+
+    def _list_album_media_ids(self, album_id):
+        """Collect only the media item IDs of a Google Photos album"""
+        media_ids = set()
+        page_token = None
+        while True:
+            body = {'albumId': album_id, 'pageSize': 100}
+            if page_token:
+                body['pageToken'] = page_token
+            response = self.session.post(
+                'https://photoslibrary.googleapis.com/v1/mediaItems:search',
+                json=body,
+                headers=self._google_auth_headers(),
+                timeout=60
+            )
+            response.raise_for_status()
+            data = response.json()
+            media_ids.update(item['id'] for item in data.get('mediaItems', []))
+            page_token = data.get('nextPageToken')
+            if not page_token:
+                return media_ids
+
+    def _compare_media_item(self, record, media_item, album_ids):
+        """Returns a list of differences between a manifest record and its Google media item"""
+        problems = []
+        if record['google_album_id'] and record['google_id'] not in album_ids:
+            problems.append('not in album')
+        
+        # Expected types come from the Flickr listing; 'video/*' accepts any video container
+        expected_mime = record['mime_type']
+        actual_mime = media_item.get('mimeType') or ''
+        if expected_mime and not (actual_mime == expected_mime or
+                                  (expected_mime.endswith('/*') and actual_mime.startswith(expected_mime[:-1]))):
+            problems.append(f"mime type {actual_mime} != {expected_mime}")
+        
+        # Flickr dimensions describe the poster frame for videos, so only check images
+        metadata = media_item.get('mediaMetadata', {})
+        if record['width'] and record['height'] and 'photo' in metadata:
+            expected = (int(record['width']), int(record['height']))
+            actual = (int(metadata.get('width', 0)), int(metadata.get('height', 0)))
+            # Rotated originals report swapped dimensions
+            if actual != expected and actual != expected[::-1]:
+                problems.append(f"dimensions {actual[0]}x{actual[1]} != {expected[0]}x{expected[1]}")
+        
+        return problems
+
+    def verify_transfers(self):
+        """Confirm recorded uploads in bulk with mediaItems:batchGet and report missing or mismatched items"""
+        records = self.manifest.records()
+        if not records:
+            print(f"No transfers recorded in {self.manifest.path}")
+            return None
+        
+        print(f"\nVerifying {len(records)} transferred items...")
+        batch_size = self.VERIFY_BATCH_SIZE
+        chunks = [records[i:i + batch_size] for i in range(0, len(records), batch_size)]
+        album_ids = {record['google_album_id'] for record in records if record['google_album_id']}
+        
+        report = {'checked': len(records), 'ok': 0, 'missing': [], 'mismatched': [], 'unverified': []}
+        
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.VERIFY_WORKERS) as executor:
+            album_futures = {
+                executor.submit(self._list_album_media_ids, album_id): album_id
+                for album_id in album_ids
+            }
+            chunk_futures = {
+                executor.submit(self._batch_get_media_items, [r['google_id'] for r in chunk]): chunk
+                for chunk in chunks
+            }
+            
+            album_members = {}
+            for future in concurrent.futures.as_completed(album_futures):
+                album_id = album_futures[future]
+                try:
+                    album_members[album_id] = future.result()
+                except Exception as e:
+                    logging.error(f"Could not list album {album_id}: {str(e)}")
+                    album_members[album_id] = None
+            
+            checked_chunks = 0
+            for future in concurrent.futures.as_completed(chunk_futures):
+                chunk = chunk_futures[future]
+                try:
+                    item_results = future.result()
+                except Exception as e:
+                    logging.error(f"batchGet failed for {len(chunk)} items: {str(e)}")
+                    report['unverified'].extend({**record, 'error': str(e)} for record in chunk)
+                    continue
+                
+                # batchGet returns one result per requested ID, in request order
+                for record, item_result in zip(chunk, item_results):
+                    if 'mediaItem' not in item_result:
+                        report['missing'].append({
+                            **record,
+                            'error': item_result.get('status', {}).get('message')
+                        })
+                        continue
+                    
+                    members = album_members.get(record['google_album_id'])
+                    # Skip the membership check when the album listing failed
+                    if members is None:
+                        members = {record['google_id']}
+                    problems = self._compare_media_item(record, item_result['mediaItem'], members)
+                    if problems:
+                        report['mismatched'].append({**record, 'problems': problems})
+                    else:
+                        report['ok'] += 1
+                
+                checked_chunks += 1
+                print(f"Progress: {checked_chunks}/{len(chunks)} batches verified")
+        
+        report_path = f'verify_report_{datetime.now().strftime("%Y%m%d_%H%M%S")}.json'
+        with open(report_path, 'w') as f:
+            json.dump(report, f, indent=2)
+        
+        summary_message = (
+            f"\nVerification summary:\n"
+            f"- Items checked: {report['checked']}\n"
+            f"- OK: {report['ok']}\n"
+            f"- Missing: {len(report['missing'])}\n"
+            f"- Mismatched: {len(report['mismatched'])}\n"
+            f"- Unverified (API errors): {len(report['unverified'])}\n"
+            f"- Report written to {report_path}"
+        )
+        print(summary_message)
+        logging.info(summary_message)
+        return report
+
+    def _guess_mime_type(self, photo_title):
+        """Map the file extension in a title to the MIME type sent on upload"""
+        extension = photo_title.lower().split('.')[-1] if '.' in photo_title else 'jpg'
+        
+        # Map extensions to MIME types
+        mime_types = {
+            'jpg': 'image/jpeg',
+            'jpeg': 'image/jpeg',
+            'png': 'image/png',
+            'gif': 'image/gif',
+            'bmp': 'image/bmp',
+            'webp': 'image/webp',
+            'heic': 'image/heic',
+            'tiff': 'image/tiff',
+            'mp4': 'video/mp4',
+            'mov': 'video/quicktime',
+            'avi': 'video/x-msvideo'
+        }
+        
+        return mime_types.get(extension, 'image/jpeg')
+
     def _upload_to_google_photos(self, photo_bytes, album_id, photo_info=None):
-        """Upload with improved error handling and memory management"""
-        MAX_RETRIES = 3
-        retry_count = 0
+        """Single upload attempt returning the created media item; failures propagate so the caller can schedule a retry"""
         thread_id = threading.get_ident()
         local_session = None
 
@@ -597,28 +1102,10 @@ class PhotoTransferer:
             photo_title = photo_info['photo']['title']['_content'] if photo_info else 'Unknown'
             photo_id = photo_info['photo']['id'] if photo_info else 'Unknown'
             
-            # Determine file type and validate
-            content_type = None
-            extension = photo_title.lower().split('.')[-1] if '.' in photo_title else 'jpg'
-            
-            # Map extensions to MIME types
-            mime_types = {
-                'jpg': 'image/jpeg',
-                'jpeg': 'image/jpeg',
-                'png': 'image/png',
-                'gif': 'image/gif',
-                'bmp': 'image/bmp',
-                'webp': 'image/webp',
-                'heic': 'image/heic',
-                'tiff': 'image/tiff',
-                'mp4': 'video/mp4',
-                'mov': 'video/quicktime',
-                'avi': 'video/x-msvideo'
-            }
-            
-            content_type = mime_types.get(extension, 'image/jpeg')
+            content_type = self._guess_mime_type(photo_title)
             
             # Ensure filename ends with correct extension
+            extension = photo_title.lower().split('.')[-1] if '.' in photo_title else 'jpg'
             if not photo_title.lower().endswith(f'.{extension}'):
                 photo_title = f"{photo_title}.{extension}"
             
@@ -628,148 +1115,121 @@ class PhotoTransferer:
             logging.info(f"  - Content Type: {content_type}")
             logging.info(f"  - Size: {len(photo_bytes) / 1024 / 1024:.2f} MB")
 
-            while retry_count < MAX_RETRIES:
-                try:
-                    # Refresh token if needed
-                    if not self.credentials.valid:
-                        self.credentials.refresh(Request())
-
-                    # Create new session for each attempt
-                    local_session = requests.Session()
-                    adapter = requests.adapters.HTTPAdapter(
-                        max_retries=3,
-                        pool_connections=1,
-                        pool_maxsize=1
-                    )
-                    local_session.mount('https://', adapter)
-                    
-                    # First stage: Upload bytes
-                    headers = {
-                        'Authorization': f'Bearer {self.credentials.token}',
-                        'Content-Type': 'application/octet-stream',
-                        'X-Goog-Upload-Protocol': 'raw',
-                        'X-Goog-Upload-Content-Type': content_type,
-                        'X-Goog-Upload-File-Name': photo_title,
-                        'User-Agent': 'flickr-to-google-photos/1.0',
-                        'Accept': '*/*'
-                    }
+            try:
+                local_session = requests.Session()
+                adapter = requests.adapters.HTTPAdapter(
+                    max_retries=3,
+                    pool_connections=1,
+                    pool_maxsize=1
+                )
+                local_session.mount('https://', adapter)
+                
+                # First stage: Upload bytes
+                headers = {
+                    **self._google_auth_headers(),
+                    'Content-Type': 'application/octet-stream',
+                    'X-Goog-Upload-Protocol': 'raw',
+                    'X-Goog-Upload-Content-Type': content_type,
+                    'X-Goog-Upload-File-Name': photo_title,
+                    'User-Agent': 'flickr-to-google-photos/1.0',
+                    'Accept': '*/*'
+                }
 
-                    logging.info(f"Thread {thread_id} - Starting upload request...")
-                    logging.info(f"Thread {thread_id} - Request details:")
-                    logging.info(f"  - URL: https://photoslibrary.googleapis.com/v1/uploads")
-                    logging.info(f"  - Headers:")
-                    for key, value in headers.items():
-                        # Ne pas logger le token complet pour des raisons de sécurité
-                        if key == 'Authorization':
-                            value = value[:30] + '...'
-                        logging.info(f"    {key}: {value}")
-                    logging.info(f"  - Data size: {len(photo_bytes)} bytes")
-                    
-                    # Use a copy of photo_bytes to prevent memory issues
-                    upload_data = photo_bytes[:]
-                    response = local_session.post(
-                        'https://photoslibrary.googleapis.com/v1/uploads',
-                        data=upload_data,
-                        headers=headers,
-                        timeout=60,
-                        verify=True
-                    )
-                    
-                    logging.info(f"Thread {thread_id} - Response details:")
-                    logging.info(f"  - Status code: {response.status_code}")
-                    logging.info(f"  - Response headers:")
-                    for key, value in response.headers.items():
-                        logging.info(f"    {key}: {value}")
-                    
-                    response.raise_for_status()
-                    upload_token = response.content.decode('utf-8')
-                    
-                    if not upload_token:
-                        raise Exception("Empty upload token received")
-                    
-                    logging.info(f"Thread {thread_id} - Upload token obtained: {upload_token[:10]}...")
-
-                    # Clear response data
-                    response = None
-                    upload_data = None
-
-                    # Second stage: Create media item with rate limiting
-                    time.sleep(self.write_request_delay)  # Attendre ~2 secondes entre chaque requête
-
-                    request_body = {
-                        'newMediaItems': [{
-                            'simpleMediaItem': {
-                                'uploadToken': upload_token
-                            }
-                        }],
-                        'albumId': album_id
-                    }
+                logging.info(f"Thread {thread_id} - Starting upload request...")
+                logging.info(f"Thread {thread_id} - Request details:")
+                logging.info(f"  - URL: https://photoslibrary.googleapis.com/v1/uploads")
+                logging.info(f"  - Headers:")
+                for key, value in headers.items():
+                    # Ne pas logger le token complet pour des raisons de sécurité
+                    if key == 'Authorization':
+                        value = value[:30] + '...'
+                    logging.info(f"    {key}: {value}")
+                logging.info(f"  - Data size: {len(photo_bytes)} bytes")
+                
+                response = local_session.post(
+                    'https://photoslibrary.googleapis.com/v1/uploads',
+                    data=self.bandwidth.wrap_upload(photo_bytes),
+                    headers=headers,
+                    timeout=60,
+                    verify=True
+                )
+                
+                logging.info(f"Thread {thread_id} - Response details:")
+                logging.info(f"  - Status code: {response.status_code}")
+                logging.info(f"  - Response headers:")
+                for key, value in response.headers.items():
+                    logging.info(f"    {key}: {value}")
+                
+                response.raise_for_status()
+                upload_token = response.content.decode('utf-8')
+                
+                if not upload_token:
+                    raise Exception("Empty upload token received")
+                
+                logging.info(f"Thread {thread_id} - Upload token obtained: {upload_token[:10]}...")
 
-                    batch_create_url = 'https://photoslibrary.googleapis.com/v1/mediaItems:batchCreate'
-                    batch_headers = {
-                        'Content-Type': 'application/json',
-                        'Authorization': f'Bearer {self.credentials.token}'
-                    }
+                # Clear response data
+                response = None
 
-                    batch_response = local_session.post(
-                        batch_create_url,
-                        json=request_body,
-                        headers=batch_headers,
-                        timeout=60
-                    )
+                # Second stage: Create media item with rate limiting
+                time.sleep(self.write_request_delay)  # Attendre ~2 secondes entre chaque requête
 
-                    if batch_response.status_code == 429:  # Too Many Requests
-                        retry_after = int(batch_response.headers.get('Retry-After', 60))
-                        logging.info(f"Rate limit hit, waiting {retry_after} seconds")
-                        time.sleep(retry_after)
-                        continue
+                request_body = {
+                    'newMediaItems': [{
+                        'simpleMediaItem': {
+                            'uploadToken': upload_token
+                        }
+                    }]
+                }
+                # Photostream items are uploaded to the library only
+                if album_id:
+                    request_body['albumId'] = album_id
 
-                    batch_response.raise_for_status()
-                    result = batch_response.json()
+                batch_create_url = 'https://photoslibrary.googleapis.com/v1/mediaItems:batchCreate'
+                batch_headers = {
+                    'Content-Type': 'application/json',
+                    **self._google_auth_headers()
+                }
 
-                    if not result.get('newMediaItemResults'):
-                        raise Exception("No results returned")
+                batch_response = local_session.post(
+                    batch_create_url,
+                    json=request_body,
+                    headers=batch_headers,
+                    timeout=60
+                )
 
-                    result = result['newMediaItemResults'][0]
-                    status = result.get('status', {})
+                # 429/5xx surface as HTTPError and are re-queued by the scheduler,
+                # honouring the Retry-After header
+                batch_response.raise_for_status()
+                result = batch_response.json()
 
-                    if status.get('message') == 'Success':
-                        if 'mediaItem' in result:
-                            media_item = result['mediaItem']
-                            logging.info(f"Thread {thread_id} - Upload successful:")
-                            logging.info(f"  - Media ID: {media_item.get('id')}")
-                            logging.info(f"  - Google filename: {media_item.get('filename')}")
-                            logging.info(f"  - Original filename: {photo_title}")
-                            logging.info(f"  - Successfully uploaded to Google Photos")
-                        return True
-                    else:
-                        raise Exception(f"Upload error: {status.get('message')}")
+                if not result.get('newMediaItemResults'):
+                    raise Exception("No results returned")
 
-                except Exception as e:
-                    retry_count += 1
-                    logging.error(f"Thread {thread_id} - Attempt {retry_count} failed:")
-                    logging.error(f"  - Photo: {photo_title}")
-                    logging.error(f"  - Error: {str(e)}")
-                    if hasattr(e, 'response'):
-                        logging.error(f"  - Response status code: {e.response.status_code}")
-                        logging.error(f"  - Response content: {e.response.content}")
-                    
-                    if retry_count < MAX_RETRIES:
-                        wait_time = (2 ** retry_count)
-                        logging.info(f"Thread {thread_id} - Waiting {wait_time}s before retry...")
-                        time.sleep(wait_time)
-                    else:
-                        raise Exception(f"Failed after {MAX_RETRIES} attempts: {str(e)}")
+                result = result['newMediaItemResults'][0]
+                status = result.get('status', {})
 
-                finally:
-                    # Clean up session
-                    if local_session:
-                        local_session.close()
-                        local_session = None
+                if status.get('message') == 'Success':
+                    media_item = result.get('mediaItem', {'id': None})
+                    logging.info(f"Thread {thread_id} - Upload successful:")
+                    logging.info(f"  - Media ID: {media_item.get('id')}")
+                    logging.info(f"  - Google filename: {media_item.get('filename')}")
+                    logging.info(f"  - Original filename: {photo_title}")
+                    logging.info(f"  - Successfully uploaded to Google Photos")
+                    return media_item
+                else:
+                    raise Exception(f"Upload error: {status.get('message')}")
+
+            except Exception as e:
+                logging.error(f"Thread {thread_id} - Upload attempt failed:")
+                logging.error(f"  - Photo: {photo_title}")
+                logging.error(f"  - Error: {str(e)}")
+                if getattr(e, 'response', None) is not None:
+                    logging.error(f"  - Response status code: {e.response.status_code}")
+                    logging.error(f"  - Response content: {e.response.content}")
+                raise
 
         finally:
             # Final cleanup
             if local_session:
                 local_session.close()
-
-        return False
\ No newline at end of file
@@ -9,13 +9,19 @@ def main():
             print("\nOptions:")
             print("1. Transfer a specific album")
             print("2. Transfer all albums")
+            print("3. Replay failed items (dead-letter queue)")
+            print("4. Verify transferred items")
+            print("5. Sync changes since last run")
             print("q. Quit")
             
             choice = input("\nSelect an option: ").strip().lower()
             
             if choice == 'q':
                 break
-                
+
+            # A Ctrl-C only stops the command it interrupted
+            transferer.shutdown_event.clear()
+
             if choice == '1':
                 # Get list of albums
                 albums = transferer.get_flickr_albums()
@@ -45,9 +51,33 @@ def main():
                     try:
                         result = transferer._transfer_single_album(album)
                         print(f"Transfer completed: {result}")
+                        if result.get('status') == 'interrupted':
+                            break
                     except Exception as e:
                         print(f"Error transferring album {album['title']['_content']}: {str(e)}")
             
+            elif choice == '3':
+                print("\nReplaying dead-lettered items...")
+                try:
+                    for result in transferer.replay_dead_letters():
+                        print(f"Replay completed: {result}")
+                except Exception as e:
+                    print(f"Error during replay: {str(e)}")
+            
+            elif choice == '4':
+                try:
+                    transferer.verify_transfers()
+                except Exception as e:
+                    print(f"Error during verification: {str(e)}")
+            
+            elif choice == '5':
+                print("\nStarting incremental sync...")
+                try:
+                    for result in transferer.sync():
+                        print(f"Sync completed: {result}")
+                except Exception as e:
+                    print(f"Error during sync: {str(e)}")
+            
             else:
                 print("Invalid option")
                 
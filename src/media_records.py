@@ -0,0 +1,97 @@
+# Flickr `original_format` values and the MIME type Google reports for them
+ORIGINAL_FORMAT_MIME_TYPES = {
+    'jpg': 'image/jpeg',
+    'jpeg': 'image/jpeg',
+    'png': 'image/png',
+    'gif': 'image/gif',
+    'tif': 'image/tiff',
+    'tiff': 'image/tiff',
+    'heic': 'image/heic',
+    'webp': 'image/webp'
+}
+
+
+class FlickrPhoto:
+    """Compact record for one item of a Flickr listing"""
+
+    __slots__ = ('id', 'title', 'media', 'url_o', 'original_format', 'width', 'height', 'size_estimate')
+
+    def __init__(self, id, title=None, media=None, url_o=None, original_format=None,
+                 width=None, height=None, size_estimate=None):
+        self.id = id
+        self.title = title
+        self.media = media
+        self.url_o = url_o
+        self.original_format = original_format
+        self.width = int(width) if width else None
+        self.height = int(height) if height else None
+        self.size_estimate = size_estimate
+
+    @classmethod
+    def from_dict(cls, item):
+        """Build from a Flickr API photo dict or from to_dict() output"""
+        return cls(
+            id=item['id'],
+            title=item.get('title'),
+            media=item.get('media'),
+            url_o=item.get('url_o'),
+            original_format=item.get('original_format') or item.get('originalformat'),
+            width=item.get('width') or item.get('width_o') or item.get('o_width'),
+            height=item.get('height') or item.get('height_o') or item.get('o_height'),
+            size_estimate=item.get('size_estimate')
+        )
+
+    def to_dict(self):
+        return {slot: getattr(self, slot) for slot in self.__slots__ if getattr(self, slot) is not None}
+
+    def expected_mime_type(self):
+        """MIME type of the original, 'video/*' when only the kind is known, None when unknown"""
+        if self.media == 'video':
+            # Flickr's original_format describes the poster frame, not the video container
+            return 'video/*'
+        return ORIGINAL_FORMAT_MIME_TYPES.get((self.original_format or '').lower())
+
+
+class GoogleMediaItem:
+    """Compact record for one item of a Google Photos album listing"""
+
+    __slots__ = ('id', 'clean_name', 'original_name', 'creation_time', 'width', 'height', 'mime_type')
+
+    def __init__(self, id, clean_name, original_name, creation_time=None,
+                 width=None, height=None, mime_type=None):
+        self.id = id
+        self.clean_name = clean_name
+        self.original_name = original_name
+        self.creation_time = creation_time
+        self.width = width
+        self.height = height
+        self.mime_type = mime_type
+
+
+class ExistingMediaIndex:
+    """Name lookup of the items already in a Google Photos album
+
+    Only name -> media item ID maps are kept, so duplicate checks are O(1)
+    and the full listing never has to stay in memory.
+    """
+
+    __slots__ = ('clean_names', 'original_names', 'count')
+
+    def __init__(self, items=()):
+        self.clean_names = {}
+        self.original_names = {}
+        self.count = 0
+        for item in items:
+            self.add(item)
+
+    def add(self, item):
+        self.clean_names[item.clean_name] = item.id
+        self.original_names[item.original_name] = item.id
+        self.count += 1
+
+    def match(self, clean_name, original_name):
+        """Google media item ID of an existing item with either name, or None"""
+        return self.clean_names.get(clean_name) or self.original_names.get(original_name)
+
+    def __len__(self):
+        return self.count
@@ -0,0 +1,210 @@
+import base64
+import binascii
+import concurrent.futures
+import contextvars
+import hashlib
+import logging
+import time
+
+import requests
+
+
+class ChecksumMismatch(Exception):
+    pass
+
+
+class RangedDownloader:
+    """Downloads large files as parallel byte ranges over pooled connections
+
+    Files below `threshold`, or served without range support, are read from
+    a single streamed GET. Each range is retried on its own, and the assembled
+    content is checked against the MD5 the server advertises (Content-MD5 or
+    x-goog-hash) when there is one. `throttle`, if
+    given, is called with the size of every chunk received.
+    """
+
+    def __init__(self, session=None, threshold=32 * 1024 * 1024, parts=4,
+                 max_range_retries=3, timeout=60, chunk_size=64 * 1024, throttle=None):
+        self.session = session or requests.Session()
+        self.threshold = threshold
+        self.parts = parts
+        self.max_range_retries = max_range_retries
+        self.timeout = timeout
+        self.chunk_size = chunk_size
+        self.throttle = throttle
+
+    def fetch(self, url, dest=None, on_size=None):
+        """Download `url` into memory (returns a bytes-like object) or into the file at `dest` (returns the path)
+
+        Size and range support are read from the response to a plain GET, so
+        small files cost a single request. For a large file that response
+        supplies the first range while the others are fetched in parallel.
+        `on_size`, if given, is called with the Content-Length before the body
+        is read.
+        """
+        with self.session.get(url, stream=True, timeout=self.timeout) as response:
+            response.raise_for_status()
+            headers = response.headers
+            size = int(headers.get('Content-Length') or 0)
+            if on_size and size:
+                on_size(size)
+            ranged = (
+                size >= self.threshold and self.parts >= 2
+                and headers.get('Accept-Ranges', '').lower() == 'bytes'
+                # Ranges of an encoded body don't line up with the decoded bytes
+                and headers.get('Content-Encoding', 'identity').lower() == 'identity'
+            )
+            if not ranged:
+                return self._read_single(response, url, dest)
+
+            # Sent with every range so a file changed mid-download answers 200 instead of 206
+            etag = headers.get('ETag', '')
+            validator = etag if etag and not etag.startswith('W/') else headers.get('Last-Modified')
+            part_size = -(-size // self.parts)
+            ranges = [(start, min(start + part_size, size) - 1) for start in range(0, size, part_size)]
+            logging.info(f"Ranged download: {size} bytes in {len(ranges)} parts from {url}")
+
+            if dest:
+                with open(dest, 'wb') as f:
+                    f.truncate(size)
+                buffer = None
+            else:
+                buffer = bytearray(size)
+
+            with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, len(ranges) - 1)) as executor:
+                # Range threads run in a copy of the caller's context so per-transfer
+                # state such as bandwidth accounting follows them
+                futures = [
+                    executor.submit(contextvars.copy_context().run, self._fetch_range_with_retry,
+                                    url, start, end, validator, buffer, dest)
+                    for start, end in ranges[1:]
+                ]
+                first_end = ranges[0][1]
+                try:
+                    self._read_range(response, 0, first_end, buffer, dest, exact=False)
+                except (requests.exceptions.RequestException, IOError) as e:
+                    logging.warning(f"Range 0-{first_end} of {url} failed ({str(e)}), retrying it on its own")
+                    self._fetch_range_with_retry(url, 0, first_end, validator, buffer, dest)
+                for future in futures:
+                    future.result()
+
+        if dest:
+            self._verify(self._file_md5(dest), headers, url)
+            return dest
+        self._verify(hashlib.md5(buffer).hexdigest(), headers, url)
+        # Returned as is: a bytes() copy would double the peak memory of large originals
+        return buffer
+
+    def _read_single(self, response, url, dest):
+        digest = hashlib.md5()
+        chunks = []
+        out = open(dest, 'wb') if dest else None
+        try:
+            for chunk in response.iter_content(chunk_size=self.chunk_size):
+                if self.throttle:
+                    self.throttle(len(chunk))
+                digest.update(chunk)
+                if out:
+                    out.write(chunk)
+                else:
+                    chunks.append(chunk)
+        finally:
+            if out:
+                out.close()
+
+        self._verify(digest.hexdigest(), response.headers, url)
+        return dest if dest else b''.join(chunks)
+
+    def _fetch_range_with_retry(self, url, start, end, validator, buffer, dest):
+        """Fetch one range, retrying only that range on failure"""
+        attempt = 0
+        while True:
+            try:
+                return self._fetch_range(url, start, end, validator, buffer, dest)
+            except (requests.exceptions.RequestException, IOError) as e:
+                attempt += 1
+                if attempt >= self.max_range_retries:
+                    raise
+                logging.warning(f"Range {start}-{end} of {url} failed ({str(e)}), retry {attempt}")
+                time.sleep(0.5 * 2 ** attempt)
+
+    def _fetch_range(self, url, start, end, validator, buffer, dest):
+        headers = {'Range': f'bytes={start}-{end}'}
+        if validator:
+            headers['If-Range'] = validator
+
+        with self.session.get(url, headers=headers, stream=True, timeout=self.timeout) as response:
+            response.raise_for_status()
+            if response.status_code != 206:
+                raise IOError(f"Expected 206 for range {start}-{end}, got {response.status_code}")
+            self._read_range(response, start, end, buffer, dest)
+
+    def _read_range(self, response, start, end, buffer, dest, exact=True):
+        """Copy bytes start..end from a response body; with exact=False a longer body is cut off"""
+        offset = start
+        out = open(dest, 'r+b') if dest else None
+        try:
+            if out:
+                out.seek(start)
+            for chunk in response.iter_content(chunk_size=self.chunk_size):
+                if self.throttle:
+                    self.throttle(len(chunk))
+                if offset + len(chunk) > end + 1:
+                    if exact:
+                        raise IOError(f"Range {start}-{end} returned more data than requested")
+                    chunk = chunk[:end + 1 - offset]
+                if out:
+                    out.write(chunk)
+                else:
+                    buffer[offset:offset + len(chunk)] = chunk
+                offset += len(chunk)
+                if offset > end:
+                    break
+        finally:
+            if out:
+                out.close()
+
+        if offset != end + 1:
+            raise IOError(f"Range {start}-{end} truncated at byte {offset}")
+
+    @staticmethod
+    def _expected_md5(headers):
+        """Hex MD5 the server guarantees for the content (Content-MD5 or x-goog-hash), if any"""
+        if headers.get('Content-MD5'):
+            try:
+                return base64.b64decode(headers['Content-MD5']).hex()
+            except (binascii.Error, ValueError):
+                pass
+        for part in headers.get('x-goog-hash', '').split(','):
+            if part.strip().startswith('md5='):
+                try:
+                    return base64.b64decode(part.strip()[4:]).hex()
+                except (binascii.Error, ValueError):
+                    pass
+        return None
+
+    @staticmethod
+    def _etag_md5(headers):
+        """ETag that merely looks like an MD5; ETags are opaque, so it is only a hint"""
+        etag = headers.get('ETag', '').strip('"')
+        if len(etag) == 32 and all(c in '0123456789abcdefABCDEF' for c in etag):
+            return etag.lower()
+        return None
+
+    @staticmethod
+    def _file_md5(path):
+        digest = hashlib.md5()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    @classmethod
+    def _verify(cls, actual_md5, headers, url):
+        expected_md5 = cls._expected_md5(headers)
+        if expected_md5 and actual_md5 != expected_md5:
+            raise ChecksumMismatch(f"MD5 mismatch for {url}: got {actual_md5}, expected {expected_md5}")
+        etag_md5 = cls._etag_md5(headers)
+        if not expected_md5 and etag_md5 and actual_md5 != etag_md5:
+            logging.info(f"ETag of {url} is not the MD5 of its content ({etag_md5}), nothing to verify against")
+        logging.info(f"Downloaded {url} (md5 {actual_md5}{', verified' if expected_md5 or actual_md5 == etag_md5 else ''})")
@@ -0,0 +1,192 @@
+import collections
+import concurrent.futures
+import heapq
+import itertools
+import random
+import threading
+import time
+
+
+class RetryQueue:
+    """Delayed queue holding failed items until their next attempt is due"""
+
+    def __init__(self, base_delay=2, max_delay=120):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._heap = []
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._heap)
+
+    def backoff(self, attempt, retry_after=None):
+        """Full-jitter exponential backoff, never shorter than a server Retry-After"""
+        if retry_after:
+            return retry_after + random.uniform(0, self.base_delay)
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    def schedule(self, item, delay):
+        with self._lock:
+            heapq.heappush(self._heap, (time.monotonic() + delay, next(self._counter), item))
+
+    def pop_due(self):
+        """Returns every item whose delay has elapsed"""
+        now = time.monotonic()
+        due = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                due.append(heapq.heappop(self._heap)[2])
+        return due
+
+    def next_due_in(self):
+        """Seconds until the next item is due, or None when the queue is empty"""
+        with self._lock:
+            if not self._heap:
+                return None
+            return max(0, self._heap[0][0] - time.monotonic())
+
+    def pop_all(self):
+        """Drains the queue regardless of due time"""
+        with self._lock:
+            items = [entry[2] for entry in sorted(self._heap)]
+            self._heap = []
+        return items
+
+
+class BatchLanes:
+    """Executor lanes with bounded read-ahead; an abandoned batch keeps its lane slot until its worker returns"""
+
+    def __init__(self, run, workers, ahead_per_worker, max_held, on_submit=None, on_release=None):
+        self._run = run  # run(batch, lane, key) on a worker thread
+        self._on_submit = on_submit
+        self._on_release = on_release
+        self._executors = {lane: concurrent.futures.ThreadPoolExecutor(max_workers=count)
+                           for lane, count in workers.items()}
+        self._limits = {lane: count * ahead_per_worker for lane, count in workers.items()}
+        self._in_flight = dict.fromkeys(workers, 0)
+        self._max_held = max_held
+        self._started = {}   # key -> monotonic time a worker picked the batch up
+        self.held = {lane: collections.deque() for lane in workers}
+        self.pending = {}    # future -> (batch, lane, key)
+        self.abandoned = {}  # future -> (batch, lane, key, note)
+        self.exhausted = False
+
+    def held_count(self):
+        return sum(len(held) for held in self.held.values())
+
+    def busy(self):
+        return bool(self.pending or self.abandoned)
+
+    def finished(self):
+        return not self.busy() and not self.held_count() and self.exhausted
+
+    def submit(self, batch, lane):
+        if self._on_submit:
+            self._on_submit(batch)
+        key = object()
+        future = self._executors[lane].submit(self._start, batch, lane, key)
+        self.pending[future] = (batch, lane, key)
+        self._in_flight[lane] += 1
+
+    def _start(self, batch, lane, key):
+        self._started[key] = time.monotonic()
+        return self._run(batch, lane, key)
+
+    def fill(self, batches):
+        """Submit held batches to lanes with room, pulling (batch, lane) pairs from `batches` as needed"""
+        while True:
+            for lane, held in self.held.items():
+                while held and self._in_flight[lane] < self._limits[lane]:
+                    self.submit(held.popleft(), lane)
+            lanes_full = all(self._in_flight[lane] >= limit for lane, limit in self._limits.items())
+            # Don't hoard batches for a busy lane while looking for work for another one
+            if self.exhausted or lanes_full or self.held_count() >= self._max_held:
+                return
+            try:
+                batch, lane = next(batches)
+            except StopIteration:
+                self.exhausted = True
+                continue
+            self.held[lane].append(batch)
+
+    def wait(self, timeout):
+        """Futures, pending or abandoned, that completed within `timeout` seconds"""
+        done, _ = concurrent.futures.wait([*self.pending, *self.abandoned], timeout=timeout,
+                                          return_when=concurrent.futures.FIRST_COMPLETED)
+        return done
+
+    def settle(self, future):
+        """Take a pending batch off the books and return it"""
+        batch, lane, key = self.pending.pop(future)
+        self._release(lane, key)
+        return batch
+
+    def overdue(self, budget_of, excluded_time):
+        """(future, batch, budget) of running batches whose time, less excluded_time(key), is past budget_of(batch)"""
+        now = time.monotonic()
+        late = []
+        for future, (batch, _, key) in self.pending.items():
+            if key not in self._started or future.done():
+                continue
+            budget = budget_of(batch)
+            if now - self._started[key] - excluded_time(key) > budget:
+                late.append((future, batch, budget))
+        return late
+
+    def abandon(self, future, note=None):
+        """Stop waiting on a running batch; `note` comes back from collect_abandoned()"""
+        batch, lane, key = self.pending.pop(future)
+        self._started.pop(key, None)
+        self.abandoned[future] = (batch, lane, key, note)
+
+    def collect_abandoned(self, future):
+        """Free the lane slot of an abandoned batch whose worker returned; gives (batch, note)"""
+        batch, lane, key, note = self.abandoned.pop(future)
+        self._release(lane, key)
+        return batch, note
+
+    def cancel_queued(self):
+        """Withdraw and return every batch no worker has started, held ones included"""
+        batches = [self.settle(future) for future in list(self.pending) if future.cancel()]
+        for held in self.held.values():
+            batches.extend(held)
+            held.clear()
+        return batches
+
+    def shutdown(self):
+        for executor in self._executors.values():
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def _release(self, lane, key):
+        self._started.pop(key, None)
+        self._in_flight[lane] -= 1
+        if self._on_release:
+            self._on_release(key)
+
+
+def pack_batches(items, size_of, max_bytes, max_items, window=256):
+    """First-fit-decreasing packing over windows of a lazy iterable; oversized items get a bin of their own"""
+    buffer = []
+    for item in items:
+        buffer.append(item)
+        if len(buffer) >= window:
+            yield from _pack_window(buffer, size_of, max_bytes, max_items)
+            buffer = []
+    if buffer:
+        yield from _pack_window(buffer, size_of, max_bytes, max_items)
+
+
+def _pack_window(items, size_of, max_bytes, max_items):
+    bins = []  # [total_bytes, items]
+    for item in sorted(items, key=size_of, reverse=True):
+        size = size_of(item)
+        for packed in bins:
+            if packed[0] + size <= max_bytes and len(packed[1]) < max_items:
+                packed[0] += size
+                packed[1].append(item)
+                break
+        else:
+            bins.append([size, [item]])
+    return [packed[1] for packed in bins]
@@ -0,0 +1,104 @@
+import asyncio
+import json
+import logging
+import threading
+import time
+from datetime import datetime, timezone
+
+import google_auth_httplib2
+import httplib2
+from google.auth.transport.requests import Request
+
+from transfer_state import atomic_write_json
+
+
+class GoogleTokenManager:
+    """Single owner of the Google OAuth credentials, refreshed ahead of expiry
+
+    Worker threads, async tasks and the discovery client all read the bearer
+    token from here, so only one refresh ever runs at a time.
+    """
+
+    # Ignore forced refreshes (401 storms) arriving right after a refresh
+    MIN_REFRESH_INTERVAL = 30
+
+    def __init__(self, credentials, token_file='token.json', refresh_margin=300):
+        self.credentials = credentials
+        self.token_file = token_file
+        self.refresh_margin = refresh_margin
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._last_refresh = 0
+
+    def start(self):
+        """Start the background refresh thread"""
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._refresh_loop,
+                name='google-token-refresh',
+                daemon=True
+            )
+            self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def _seconds_until_refresh(self):
+        """Seconds before a refresh is due, or None when the token has no known expiry"""
+        if not self.credentials.token:
+            return 0
+        if self.credentials.expiry is None:
+            return None
+        # google-auth stores expiry as a naive UTC datetime
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        return (self.credentials.expiry - now).total_seconds() - self.refresh_margin
+
+    def get_token(self):
+        """Current bearer token, refreshed first if it is about to expire"""
+        with self._lock:
+            remaining = self._seconds_until_refresh()
+            if remaining is not None and remaining <= 0:
+                self._refresh_locked()
+            return self.credentials.token
+
+    async def get_token_async(self):
+        """Same as get_token() without blocking the event loop during a refresh"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.get_token)
+
+    def refresh(self, request=None):
+        """Force a refresh, e.g. after a 401; concurrent callers share one refresh"""
+        with self._lock:
+            if time.monotonic() - self._last_refresh < self.MIN_REFRESH_INTERVAL:
+                return
+            self._refresh_locked()
+
+    def _refresh_locked(self):
+        self.credentials.refresh(Request())
+        self._last_refresh = time.monotonic()
+        atomic_write_json(self.token_file, json.loads(self.credentials.to_json()))
+        logging.info(f"Google access token refreshed, expires at {self.credentials.expiry}")
+
+    def _refresh_loop(self):
+        while True:
+            try:
+                self.get_token()
+            except Exception as e:
+                logging.error(f"Background token refresh failed: {str(e)}")
+            remaining = self._seconds_until_refresh()
+            # Re-check at least every minute so a suspended machine catches up quickly
+            wait = 60 if remaining is None else min(max(remaining, 5), 60)
+            if self._stop_event.wait(wait):
+                return
+
+    # google_auth_httplib2.AuthorizedHttp only needs before_request/refresh/apply,
+    # so the manager itself stands in for the credentials of the discovery client
+    def before_request(self, request, method, url, headers):
+        self.apply(headers)
+
+    def apply(self, headers, token=None):
+        headers['authorization'] = f'Bearer {token or self.get_token()}'
+
+    def authorized_http(self):
+        return google_auth_httplib2.AuthorizedHttp(self, http=httplib2.Http())
@@ -0,0 +1,178 @@
+import json
+import os
+import threading
+from datetime import datetime
+
+
+def atomic_write_json(path, data):
+    """Write JSON to a temp file and swap it in so readers never see a partial file"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class DeadLetterQueue:
+    """Append-only JSON Lines list of photos that ran out of transfer attempts
+
+    Removals are written as tombstone lines, so recording a failure never
+    rewrites the file; compact() drops superseded lines.
+    """
+
+    def __init__(self, path='dead_letter.jsonl'):
+        self.path = path
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(entry):
+        return (entry['photo']['id'], entry['google_album_id'])
+
+    def _append(self, lines):
+        with self._lock:
+            with open(self.path, 'a') as f:
+                f.writelines(json.dumps(line) + '\n' for line in lines)
+
+    def entries(self):
+        """Live entries, latest failure per photo/album pair"""
+        if not os.path.exists(self.path):
+            return []
+        live = {}
+        with self._lock:
+            with open(self.path) as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    entry = json.loads(line)
+                    if entry.get('tombstone'):
+                        live.pop((entry['flickr_id'], entry['google_album_id']), None)
+                    else:
+                        # Re-adding moves the pair to the end, like a fresh failure
+                        key = self._key(entry)
+                        live.pop(key, None)
+                        live[key] = entry
+        return list(live.values())
+
+    def add(self, photo, google_album_id, album_name, error_class, error, attempts):
+        self._append([{
+            'photo': photo,
+            'google_album_id': google_album_id,
+            'album_name': album_name,
+            'error_class': error_class,
+            'error': error,
+            'attempts': attempts,
+            'failed_at': datetime.now().isoformat()
+        }])
+
+    def remove(self, entries_to_remove):
+        self._append([self._tombstone(*self._key(e)) for e in entries_to_remove])
+
+    def discard(self, flickr_id, google_album_id):
+        """Drop the entry for one photo/album pair, if there is one"""
+        self._append([self._tombstone(flickr_id, google_album_id)])
+
+    def compact(self):
+        """Rewrite the file with only its live entries"""
+        entries = self.entries()
+        tmp_path = f"{self.path}.tmp"
+        with self._lock:
+            with open(tmp_path, 'w') as f:
+                f.writelines(json.dumps(entry) + '\n' for entry in entries)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        return entries
+
+    @staticmethod
+    def _tombstone(flickr_id, google_album_id):
+        return {'tombstone': True, 'flickr_id': flickr_id, 'google_album_id': google_album_id}
+
+
+class TransferManifest:
+    """Append-only JSON Lines record of every successful upload"""
+
+    def __init__(self, path='transfer_manifest.jsonl'):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def record(self, flickr_id, google_id, google_album_id, filename, mime_type, width=None, height=None):
+        entry = {
+            'flickr_id': flickr_id,
+            'google_id': google_id,
+            'google_album_id': google_album_id,
+            'filename': filename,
+            'mime_type': mime_type,
+            'width': width,
+            'height': height,
+            'transferred_at': datetime.now().isoformat()
+        }
+        with self._lock:
+            with open(self.path, 'a') as f:
+                f.write(json.dumps(entry) + '\n')
+
+    def records(self):
+        """Latest record per Flickr photo and target album"""
+        if not os.path.exists(self.path):
+            return []
+        latest = {}
+        with self._lock:
+            with open(self.path) as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        latest[(entry['flickr_id'], entry['google_album_id'])] = entry
+        return list(latest.values())
+
+    def flickr_ids_by_album(self):
+        """Map of Google album ID (None for library-only uploads) to the Flickr IDs recorded there"""
+        known = {}
+        if not os.path.exists(self.path):
+            return known
+        with self._lock:
+            with open(self.path) as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        known.setdefault(entry['google_album_id'], set()).add(entry['flickr_id'])
+        return known
+
+
+class SyncState:
+    """Persisted high-water marks for incremental sync
+
+    Albums are tracked by the Flickr photoset `date_update` seen at their
+    last successful sync, the photostream by the time that sync started.
+    """
+
+    def __init__(self, path='sync_state.json'):
+        self.path = path
+        self._lock = threading.Lock()
+        self._state = {'albums': {}, 'photostream': {}}
+        if os.path.exists(path):
+            with open(path) as f:
+                self._state.update(json.load(f))
+
+    def album(self, flickr_album_id):
+        return self._state['albums'].get(flickr_album_id)
+
+    def set_album(self, flickr_album_id, title, date_update, google_album_id):
+        with self._lock:
+            self._state['albums'][flickr_album_id] = {
+                'title': title,
+                'date_update': date_update,
+                'google_album_id': google_album_id,
+                'synced_at': datetime.now().isoformat()
+            }
+            atomic_write_json(self.path, self._state)
+
+    def photostream_mark(self):
+        return self._state['photostream'].get('min_date')
+
+    def set_photostream_mark(self, min_date):
+        with self._lock:
+            self._state['photostream'] = {
+                'min_date': min_date,
+                'synced_at': datetime.now().isoformat()
+            }
+            atomic_write_json(self.path, self._state)
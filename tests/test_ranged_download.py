@@ -0,0 +1,168 @@
+import base64
+import hashlib
+import os
+import re
+import sys
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from ranged_download import ChecksumMismatch, RangedDownloader  # noqa: E402
+
+DATA = os.urandom(1024 * 1024 + 123)
+DATA_MD5 = hashlib.md5(DATA).hexdigest()
+
+
+def b64_md5(hex_digest):
+    return base64.b64encode(bytes.fromhex(hex_digest)).decode()
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    """Serves DATA with the server's checksum headers, honouring Range requests when allowed"""
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        requested = self.headers.get('Range')
+        server.requests.append(requested)
+
+        if requested and server.ranges:
+            start, end = map(int, re.match(r'bytes=(\d+)-(\d+)', requested).groups())
+            body = DATA[start:end + 1]
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{end}/{len(DATA)}')
+            if start in server.truncate_once:
+                server.truncate_once.discard(start)
+                self._send_headers(len(body))
+                self.wfile.write(body[:100])
+                self.close_connection = True
+                return
+        else:
+            body = DATA
+            self.send_response(200)
+        self._send_headers(len(body))
+        self.wfile.write(body)
+
+    def _send_headers(self, length):
+        self.send_header('ETag', f'"{self.server.etag}"')
+        for name, value in self.server.extra_headers.items():
+            self.send_header(name, value)
+        if self.server.ranges:
+            self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Content-Length', str(length))
+        self.end_headers()
+
+
+class RangeServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), RangeHandler)
+        self.requests = []
+        self.ranges = True
+        self.truncate_once = set()
+        self.etag = DATA_MD5
+        self.extra_headers = {}
+
+    def handle_error(self, request, client_address):
+        # The downloader closes the first response early on purpose
+        pass
+
+
+class RangedDownloaderTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = RangeServer()
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.url = f'http://127.0.0.1:{cls.server.server_port}/photo.jpg'
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.server.requests = []
+        self.server.ranges = True
+        self.server.truncate_once = set()
+        self.server.etag = DATA_MD5
+        self.server.extra_headers = {}
+        self.downloader = RangedDownloader(threshold=256 * 1024, parts=4, timeout=5)
+        self.part_size = -(-len(DATA) // 4)
+
+    def ranges_requested(self):
+        return sorted(int(r.split('=')[1].split('-')[0]) for r in self.server.requests if r)
+
+    def test_ranged_download_into_buffer(self):
+        content = self.downloader.fetch(self.url)
+
+        self.assertEqual(content, DATA)
+        # The plain GET supplies the first range, the other three are requested
+        self.assertEqual(self.server.requests.count(None), 1)
+        self.assertEqual(self.ranges_requested(), [self.part_size, 2 * self.part_size, 3 * self.part_size])
+
+    def test_ranged_download_into_file(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            dest = os.path.join(tmp, 'photo.jpg')
+            self.assertEqual(self.downloader.fetch(self.url, dest=dest), dest)
+            with open(dest, 'rb') as f:
+                self.assertEqual(f.read(), DATA)
+
+    def test_falls_back_to_single_get_without_range_support(self):
+        self.server.ranges = False
+
+        self.assertEqual(self.downloader.fetch(self.url), DATA)
+        self.assertEqual(self.server.requests, [None])
+
+    def test_small_file_uses_single_get(self):
+        downloader = RangedDownloader(threshold=len(DATA) + 1, timeout=5)
+
+        self.assertEqual(downloader.fetch(self.url), DATA)
+        self.assertEqual(self.server.requests, [None])
+
+    def test_truncated_range_is_retried_on_its_own(self):
+        self.server.truncate_once = {2 * self.part_size}
+
+        self.assertEqual(self.downloader.fetch(self.url), DATA)
+        self.assertEqual(self.ranges_requested(),
+                         [self.part_size, 2 * self.part_size, 2 * self.part_size, 3 * self.part_size])
+
+    def test_content_md5_mismatch(self):
+        self.server.extra_headers = {'Content-MD5': b64_md5('0' * 32)}
+
+        with self.assertRaises(ChecksumMismatch):
+            self.downloader.fetch(self.url)
+
+    def test_goog_hash_mismatch(self):
+        self.server.extra_headers = {'x-goog-hash': f"crc32c=AAAAAA==,md5={b64_md5('0' * 32)}"}
+
+        with self.assertRaises(ChecksumMismatch):
+            self.downloader.fetch(self.url)
+
+    def test_goog_hash_match(self):
+        self.server.extra_headers = {'x-goog-hash': f'md5={b64_md5(DATA_MD5)}'}
+
+        self.assertEqual(self.downloader.fetch(self.url), DATA)
+
+    def test_malformed_goog_hash_is_ignored(self):
+        self.server.extra_headers = {'x-goog-hash': 'md5=not-base64!'}
+
+        self.assertEqual(self.downloader.fetch(self.url), DATA)
+
+    def test_md5_shaped_etag_is_not_enforced(self):
+        # ETags are opaque; a CDN may use any 32-hex value
+        self.server.etag = '0' * 32
+
+        self.assertEqual(self.downloader.fetch(self.url), DATA)
+
+
+if __name__ == '__main__':
+    unittest.main()